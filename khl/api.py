@@ -16,17 +16,21 @@ class _Req:
 
 def req(method: str, **http_fields):
     def _method(func: Callable):
+        # invariants of the endpoint, resolved once here instead of on every call
+        route = re.sub(r'(?<!^)(?=[A-Z])', '-', func.__qualname__).lower().replace('.', '/')
+        param_names = list(inspect.signature(func).parameters.keys())
+        payload_key = 'data' if method == 'POST' else 'params'
+
         @functools.wraps(func)
         def req_maker(*args, **kwargs) -> _Req:
-            route = re.sub(r'(?<!^)(?=[A-Z])', '-', func.__qualname__).lower().replace('.', '/')
-
             # dump args into kwargs
-            param_names = list(inspect.signature(func).parameters.keys())
-            for i in range(len(args)):
-                kwargs[param_names[i]] = args[i]
+            if len(args) > len(param_names):
+                raise TypeError(f'{func.__qualname__}() takes {len(param_names)} positional arguments '
+                                f'but {len(args)} were given')
+            kwargs.update(zip(param_names, args))
 
             # merge http_fields with kwargs
-            params = {'data' if method == 'POST' else 'params': kwargs}
+            params = {payload_key: kwargs}
             params.update(http_fields)
 
             return _Req(method, route, params)
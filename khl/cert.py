@@ -1,7 +1,7 @@
 import base64
-import json
 from enum import Enum
 
+import orjson
 from Cryptodome.Cipher import AES
 from Cryptodome.Util import Padding
 
@@ -65,5 +65,5 @@ class Cert:
         return data.decode('utf-8')
 
     def decode_raw(self, data: bytes) -> dict:
-        data = json.loads(str(data, encoding='utf-8'))
-        return json.loads(self.decrypt(data['encrypt'])) if ('encrypt' in data.keys()) else data
+        data = orjson.loads(data)
+        return orjson.loads(self.decrypt(data['encrypt'])) if ('encrypt' in data) else data
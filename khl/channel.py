@@ -8,11 +8,19 @@ from . import api, User
 from .gateway import Requestable, Gateway
 from .interface import LazyLoadable, MessageTypes, ChannelTypes, InviteDurationTypes, InviteSettingTimesTypes
 
+# fields filled from payload in `PublicChannel._update_fields()`, besides `type` which needs conversion
+_PUBLIC_FIELDS = ('name', 'user_id', 'guild_id', 'topic', 'is_category', 'parent_id', 'level', 'permission_overwrites',
+                  'permission_users', 'permission_sync')
+# fields filled from payload in `PrivateChannel.__init__()`
+_PRIVATE_FIELDS = ('code', 'last_read_time', 'latest_msg_time', 'unread_count', 'is_friend', 'is_blocked',
+                   'is_target_blocked', 'target_info')
+
 
 class Channel(LazyLoadable, Requestable, ABC):
     """
     Interface, represents a channel where messages flowing
     """
+    __slots__ = ()
     type: ChannelTypes
 
     @abstractmethod
@@ -29,6 +37,8 @@ class Channel(LazyLoadable, Requestable, ABC):
 
 
 class PublicChannel(Channel, ABC):
+    __slots__ = _PUBLIC_FIELDS + ('type', '_id', '_loaded', 'gate')
+
     name: str
     user_id: str
     guild_id: str
@@ -51,17 +61,9 @@ class PublicChannel(Channel, ABC):
         return self._id
 
     def _update_fields(self, **kwargs):
-        self.name: str = kwargs.get('name')
-        self.user_id: str = kwargs.get('user_id')
-        self.guild_id: str = kwargs.get('guild_id')
-        self.topic: str = kwargs.get('topic')
-        self.is_category: int = kwargs.get('is_category')
-        self.parent_id: str = kwargs.get('parent_id')
-        self.level: int = kwargs.get('level')
+        for k in _PUBLIC_FIELDS:
+            setattr(self, k, kwargs.get(k))
         self.type: ChannelTypes = kwargs.get('type') and ChannelTypes(kwargs.get('type'))
-        self.permission_overwrites: list = kwargs.get('permission_overwrites')
-        self.permission_users: list = kwargs.get('permission_users')
-        self.permission_sync: int = kwargs.get('permission_sync')
 
     async def load(self):
         self._update_fields(**(await self.gate.exec_req(api.Channel.view(self.id))))
@@ -102,6 +104,8 @@ class PublicTextChannel(PublicChannel):
 
     Text chat channels in guild
     """
+    __slots__ = ('slow_mode',)
+
     slow_mode: int
 
     def __init__(self, **kwargs):
@@ -145,6 +149,8 @@ class PublicVoiceChannel(PublicChannel):
 
     a placeholder now for future design/adaption
     """
+    __slots__ = ()
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
@@ -168,6 +174,7 @@ class PrivateChannel(Channel):
     """
     Private chat channel
     """
+    __slots__ = _PRIVATE_FIELDS + ('_loaded', 'gate')
 
     code: str
     last_read_time: int
@@ -179,14 +186,8 @@ class PrivateChannel(Channel):
     target_info: Dict
 
     def __init__(self, **kwargs):
-        self.code: str = kwargs.get('code')
-        self.last_read_time: int = kwargs.get('last_read_time')
-        self.latest_msg_time: int = kwargs.get('latest_msg_time')
-        self.unread_count: int = kwargs.get('unread_count')
-        self.is_friend: bool = kwargs.get('is_friend')
-        self.is_blocked: bool = kwargs.get('is_blocked')
-        self.is_target_blocked: bool = kwargs.get('is_target_blocked')
-        self.target_info: Dict = kwargs.get('target_info')
+        for k in _PRIVATE_FIELDS:
+            setattr(self, k, kwargs.get(k))
 
         self._loaded = kwargs.get('_lazy_loaded_', False)
         self.gate = kwargs.get('_gate_')
@@ -1,6 +1,8 @@
 import asyncio
 from abc import ABC
-from typing import Union, List
+from typing import Union, List, AsyncIterator
+
+from cachetools import TTLCache
 
 from .api import _Req
 from .receiver import Receiver
@@ -15,10 +17,13 @@ class Gateway:
     """
     requester: HTTPRequester
     receiver: Receiver
+    user_cache: TTLCache
+    """users fetched via this gate, keyed by (guild_id, user_id)"""
 
     def __init__(self, requester: HTTPRequester, receiver: Receiver):
         self.requester = requester
         self.receiver = receiver
+        self.user_cache = TTLCache(maxsize=10_000, ttl=300)
 
     async def request(self, method: str, route: str, **params) -> Union[dict, list]:
         """
@@ -37,9 +42,28 @@ class Gateway:
         return await self.requester.exec_pagination_req(r, begin_page=begin_page, end_page=end_page,
                                                         page_size=page_size, sort=sort)
 
+    async def exec_pagination_req_parallel(self, r: _Req, *, page_size: int = 50, sort: str = '',
+                                           concurrency: int = 64) -> List:
+        return await self.requester.exec_pagination_req_parallel(r, page_size=page_size, sort=sort,
+                                                                 concurrency=concurrency)
+
+    def iter_pagination_req(self, r: _Req, *, begin_page: int = 1, end_page: int = None,
+                            page_size: int = 50, sort: str = '') -> AsyncIterator:
+        return self.requester.iter_pagination_req(r, begin_page=begin_page, end_page=end_page,
+                                                  page_size=page_size, sort=sort)
+
+    def invalidate_user(self, guild_id: str, user_id: str):
+        """
+        drop the cached user, should be called after the user is modified
+        """
+        self.user_cache.pop((guild_id, user_id), None)
+
     async def run(self, in_queue: asyncio.Queue):
         self.receiver.pkg_queue = in_queue
-        await self.receiver.start()
+        try:
+            await self.receiver.start()
+        finally:
+            await self.receiver.close()
 
 
 class Requestable(ABC):
@@ -51,4 +75,5 @@ class Requestable(ABC):
 
         `Guild`: guild.get_roles() to fetch role list from khl
     """
+    __slots__ = ()
     gate: Gateway
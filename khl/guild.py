@@ -1,6 +1,11 @@
-from os import remove
-from typing import List, Dict, Union
-from PIL import Image
+import asyncio
+import io
+import logging
+import os
+import time
+from typing import List, Dict, Union, Tuple, Callable, Coroutine, AsyncIterator
+
+import aiofiles
 
 from . import api
 from .channel import Channel, public_channel_factory
@@ -9,6 +14,20 @@ from .interface import LazyLoadable, ChannelTypes, GuildMuteTypes, InviteDuratio
 from .role import Role
 from .user import User
 
+log = logging.getLogger(__name__)
+
+# (field, default) pairs filled from payload in `Guild._update_fields()`
+_FIELDS = (('name', ''), ('topic', ''), ('master_id', ''), ('icon', ''), ('notify_type', 0), ('region', ''),
+           ('enable_open', False), ('open_id', ''), ('default_channel_id', ''), ('welcome_channel_id', ''))
+
+
+def _unpack_id(obj: Union[User, Role, str]):
+    """get id from a `User`/`Role`, or pass through if it is already an id"""
+    try:
+        return obj.id
+    except AttributeError:
+        return obj
+
 
 class Guild(LazyLoadable, Requestable):
     """
@@ -16,6 +35,17 @@ class Guild(LazyLoadable, Requestable):
 
     represent a server where users gathered in and contains channels
     """
+    __slots__ = ('id', 'name', 'topic', 'master_id', 'icon', 'notify_type', 'region', 'enable_open', 'open_id',
+                 'default_channel_id', 'welcome_channel_id', '_roles', '_channel_categories', '_channels',
+                 '_channels_ts', '_roles_ts', '_inflight', '_loaded', 'gate')
+
+    CHANNEL_TTL = 60
+    """seconds that a fetched channel list keeps fresh"""
+    ROLE_TTL = 60
+    """seconds that a fetched role list keeps fresh"""
+    USER_FETCH_CONCURRENCY = 64
+    """max requests in flight at the same time in ``fetch_users()``"""
+
     id: str
     name: str
     topic: str
@@ -30,42 +60,86 @@ class Guild(LazyLoadable, Requestable):
     _roles: List[Role]
     _channel_categories: List[Dict]
     _channels: List[Channel]
+    _channels_ts: float
+    _roles_ts: float
+    _inflight: Dict[Tuple, asyncio.Future]
 
     def __init__(self, **kwargs):
         self.id = kwargs.get('id')
         self._channel_categories = []
+        self._channels_ts = 0.0
+        self._roles_ts = 0.0
+        self._inflight = {}
         self._loaded = kwargs.get('_lazy_loaded_', False)
         self.gate = kwargs.get('_gate_', None)
         self._update_fields(**kwargs)
 
     def _update_fields(self, **kwargs):
-        self.name = kwargs.get('name', '')
-        self.topic = kwargs.get('topic', '')
-        self.master_id = kwargs.get('master_id', '')
-        self.icon = kwargs.get('icon', '')
-        self.notify_type = kwargs.get('notify_type', 0)
-        self.region = kwargs.get('region', '')
-        self.enable_open = kwargs.get('enable_open', False)
-        self.open_id = kwargs.get('open_id', '')
-        self.default_channel_id = kwargs.get('default_channel_id', '')
-        self.welcome_channel_id = kwargs.get('welcome_channel_id', '')
-        self._roles = kwargs.get('roles', None)
-        self._channels = kwargs.get('channels', None)
+        for k, default in _FIELDS:
+            setattr(self, k, kwargs.get(k, default))
+        self._roles = None
+        self._channels = None
+        if kwargs.get('roles') is not None:
+            self._set_roles(kwargs['roles'])
+        if kwargs.get('channels') is not None:
+            self._set_channels(kwargs['channels'])
 
     async def load(self):
-        self._update_fields(**(await self.gate.exec_req(api.Guild.view(self.id))))
+        raw = await self._singleflight(('guild',), lambda: self.gate.exec_req(api.Guild.view(self.id)))
+        self._update_fields(**raw)
         self._loaded = True
 
-    async def fetch_channel_list(self, force_update: bool = True) -> List[Channel]:
+    async def _singleflight(self, key: Tuple, coro_factory: Callable[[], Coroutine]):
+        """
+        await the in-flight request which has the same ``key``, only dispatch a new one if there is none
+
+        so concurrent identical requests on this guild collapse into one
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(coro_factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    def _set_channels(self, raw_list: List[Dict]):
+        # hoisted into locals, this runs over every channel in the guild
+        category = ChannelTypes.CATEGORY.value
+        factory = public_channel_factory
+        gate = self.gate
+        categories: List[Dict] = []
+        channels: List[Dict] = []
+        for i in raw_list:
+            (categories if i['type'] == category else channels).append(i)
+        self._channel_categories = categories
+        self._channels = [factory(_gate_=gate, **i) for i in channels]
+        self._channels_ts = time.monotonic()
+
+    def _set_roles(self, raw_list: List[Dict]):
+        self._roles = [Role(**i) for i in raw_list]
+        self._roles_ts = time.monotonic()
+
+    async def _revalidate(self, key: Tuple, refresh: Callable[[], Coroutine]):
+        """run ``refresh`` in background, join the in-flight one if there is"""
+        try:
+            await self._singleflight(key, refresh)
+        except Exception as e:
+            log.exception('error raised during background refresh', exc_info=e)
+
+    async def _refresh_channels(self):
+        self._set_channels(await self.gate.exec_pagination_req(api.Channel.list(guild_id=self.id)))
+
+    async def fetch_channel_list(self, force_update: bool = False) -> List[Channel]:
+        """
+        get guild's channel list
+
+        cached list is returned within ``CHANNEL_TTL`` seconds,
+        once stale the cached list is still returned while a refresh runs in background
+        """
         if force_update or self._channels is None:
-            raw_list = await self.gate.exec_pagination_req(api.Channel.list(guild_id=self.id))
-            channel_list: List[Channel] = []
-            for i in raw_list:
-                if i['type'] == ChannelTypes.CATEGORY:
-                    self._channel_categories.append(i)
-                else:
-                    channel_list.append(public_channel_factory(_gate_=self.gate, **i))
-            self._channels = channel_list
+            await self._singleflight(('channels',), self._refresh_channels)
+        elif time.monotonic() - self._channels_ts >= self.CHANNEL_TTL:
+            asyncio.ensure_future(self._revalidate(('channels',), self._refresh_channels))
         return self._channels
 
     @property
@@ -83,49 +157,120 @@ class Guild(LazyLoadable, Requestable):
             return self._channels
         raise ValueError('not loaded, please call `await fetch_channel_list()` first')
 
+    async def iter_user(self, channel: Channel) -> AsyncIterator[User]:
+        """
+        iterate over users in the channel page by page, the whole list is never held in memory
+
+        RECOMMEND for large guilds, ``list_user()`` collects all users before returning
+        """
+        async for i in self.gate.iter_pagination_req(api.Guild.userList(guild_id=self.id, channel_id=channel.id)):
+            yield User(_gate_=self.gate, _lazy_loaded_=True, **i)
+
     async def list_user(self, channel: Channel) -> List[User]:
-        users = await self.gate.exec_pagination_req(api.Guild.userList(guild_id=self.id, channel_id=channel.id))
-        return [User(_gate_=self.gate, _lazy_loaded_=True, **i) for i in users]
+        """list users in the channel, pages are fetched concurrently"""
+
+        async def collect() -> List[User]:
+            users = await self.gate.exec_pagination_req_parallel(
+                api.Guild.userList(guild_id=self.id, channel_id=channel.id))
+            return [User(_gate_=self.gate, _lazy_loaded_=True, **i) for i in users]
+
+        return await self._singleflight(('user_list', channel.id), collect)
 
-    async def fetch_user(self, user_id: str) -> User:
+    async def fetch_user(self, user_id: str, force_update: bool = False) -> User:
         """get user object from user_id, can only fetch user in current guild
+
+        fetched users are cached in the gate for a while, use ``force_update`` to bypass the cache
         """
-        user = await self.gate.exec_req(api.User.view(user_id=user_id, guild_id=self.id))
-        return User(_gate_=self.gate, _lazy_loaded_=True, **user)
+        if not force_update:
+            user = self.gate.user_cache.get((self.id, user_id))
+            if user is not None:
+                return user
+
+        async def fetch() -> User:
+            raw = await self.gate.exec_req(api.User.view(user_id=user_id, guild_id=self.id))
+            fetched = User(_gate_=self.gate, _lazy_loaded_=True, **raw)
+            self.gate.user_cache[(self.id, user_id)] = fetched
+            return fetched
+
+        return await self._singleflight(('user', user_id), fetch)
+
+    async def fetch_users(self, user_ids: List[str]) -> List[User]:
+        """
+        get user objects from user_ids, can only fetch users in current guild
+
+        requests are sent concurrently, at most ``USER_FETCH_CONCURRENCY`` of them in flight at the same time
+        """
+        sem = asyncio.Semaphore(self.USER_FETCH_CONCURRENCY)
+
+        async def fetch(user_id: str) -> User:
+            async with sem:
+                return await self.fetch_user(user_id)
+
+        unique_ids = list(dict.fromkeys(user_ids))
+        users = dict(zip(unique_ids, await asyncio.gather(*[fetch(i) for i in unique_ids])))
+        return [users[i] for i in user_ids]
 
     async def set_user_nickname(self, user: User, new_nickname: str):
         await self.gate.exec_req(api.Guild.nickname(guild_id=self.id, nickname=new_nickname, user_id=user.id))
+        self.gate.invalidate_user(self.id, user.id)
+
+    async def _refresh_roles(self):
+        self._set_roles(await self.gate.exec_pagination_req(api.GuildRole.list(guild_id=self.id)))
 
-    async def fetch_roles(self, force_update: bool = True) -> List[Role]:
+    async def fetch_roles(self, force_update: bool = False) -> List[Role]:
+        """
+        get guild's role list
+
+        cached list is returned within ``ROLE_TTL`` seconds,
+        once stale the cached list is still returned while a refresh runs in background
+        """
         if force_update or self._roles is None:
-            raw_list = await self.gate.exec_pagination_req(api.GuildRole.list(guild_id=self.id))
-            self._roles = [Role(**i) for i in raw_list]
+            await self._singleflight(('roles',), self._refresh_roles)
+        elif time.monotonic() - self._roles_ts >= self.ROLE_TTL:
+            asyncio.ensure_future(self._revalidate(('roles',), self._refresh_roles))
         return self._roles
 
     async def create_role(self, role_name: str) -> Role:
-        return Role(**(await self.gate.exec_req(api.GuildRole.create(guild_id=self.id, name=role_name))))
+        role = Role(**(await self.gate.exec_req(api.GuildRole.create(guild_id=self.id, name=role_name))))
+        self._roles = None  # cached list is outdated, refetch on next ``fetch_roles()``
+        return role
 
     async def update_role(self, new_role: Role) -> Role:
-        return Role(**(await self.gate.exec_req(api.GuildRole.update(guild_id=self.id, **vars(new_role)))))
+        role = Role(**(await self.gate.exec_req(
+            api.GuildRole.update(guild_id=self.id,
+                                 role_id=new_role.id,
+                                 hoist=new_role.hoist,
+                                 mentionable=new_role.mentionable,
+                                 permissions=new_role.permissions,
+                                 color=new_role.color,
+                                 name=new_role.name))))
+        self._roles = None
+        return role
 
     async def delete_role(self, role_id: int):
-        return await self.gate.exec_req(api.GuildRole.delete(guild_id=self.id, role_id=role_id))
+        ret = await self.gate.exec_req(api.GuildRole.delete(guild_id=self.id, role_id=role_id))
+        self._roles = None
+        return ret
 
     async def grant_role(self, user: User, role: Union[Role, str]):
         """
         docs:
         https://developer.kaiheila.cn/doc/http/guild-role#%E8%B5%8B%E4%BA%88%E7%94%A8%E6%88%B7%E8%A7%92%E8%89%B2
         """
-        role_id = role.id if isinstance(role, Role) else role
-        return await self.gate.exec_req(api.GuildRole.grant(guild_id=self.id, user_id=user.id, role_id=role_id))
+        role_id = _unpack_id(role)
+        ret = await self.gate.exec_req(api.GuildRole.grant(guild_id=self.id, user_id=user.id, role_id=role_id))
+        self.gate.invalidate_user(self.id, user.id)
+        return ret
 
     async def revoke_role(self, user: User, role: Union[Role, str]):
         """
         docs:
         https://developer.kaiheila.cn/doc/http/guild-role#%E5%88%A0%E9%99%A4%E7%94%A8%E6%88%B7%E8%A7%92%E8%89%B2
         """
-        role_id = role.id if isinstance(role, Role) else role
-        return await self.gate.exec_req(api.GuildRole.revoke(guild_id=self.id, user_id=user.id, role_id=role_id))
+        role_id = _unpack_id(role)
+        ret = await self.gate.exec_req(api.GuildRole.revoke(guild_id=self.id, user_id=user.id, role_id=role_id))
+        self.gate.invalidate_user(self.id, user.id)
+        return ret
 
     async def create_channel(self,
                              name: str,
@@ -143,11 +288,15 @@ class Guild(LazyLoadable, Requestable):
             params['limit_amount'] = limit_amount
         if voice_quality:
             params['voice_quality'] = voice_quality
-        return public_channel_factory(self.gate, **(await self.gate.exec_req(api.Channel.create(**params))))
+        channel = public_channel_factory(self.gate, **(await self.gate.exec_req(api.Channel.create(**params))))
+        self._channels = None  # cached list is outdated, refetch on next ``fetch_channel_list()``
+        return channel
 
     async def kickout(self, user: Union[User, str]):
-        target_id = user.id if isinstance(user, User) else user
-        return await self.gate.exec_req(api.Guild.kickout(guild_id=self.id, target_id=target_id))
+        target_id = _unpack_id(user)
+        ret = await self.gate.exec_req(api.Guild.kickout(guild_id=self.id, target_id=target_id))
+        self.gate.invalidate_user(self.id, target_id)
+        return ret
 
     async def leave(self):
         """leave from this guild"""
@@ -155,42 +304,54 @@ class Guild(LazyLoadable, Requestable):
 
     async def get_mute_list(self, return_type: str = 'detail'):
         """get mute list from this guild"""
-        return await self.gate.exec_req(api.GuildMute.list(guild_id=self.id, return_type=return_type))
+        return await self._singleflight(
+            ('mute_list', return_type),
+            lambda: self.gate.exec_req(api.GuildMute.list(guild_id=self.id, return_type=return_type)))
 
     async def mute(self, user: Union[User, str], type: GuildMuteTypes):
         """create mute on this guild"""
-        user_id = user.id if isinstance(user, User) else user
+        user_id = _unpack_id(user)
         return await self.gate.exec_req(api.GuildMute.create(guild_id=self.id, user_id=user_id, type=type.value))
 
     async def unmute(self, user: Union[User, str], type: GuildMuteTypes):
         """delete mute from this guild"""
-        user_id = user.id if isinstance(user, User) else user
+        user_id = _unpack_id(user)
         return await self.gate.exec_req(api.GuildMute.delete(guild_id=self.id, user_id=user_id, type=type.value))
 
     async def get_blacklist(self):
         """get blacklist from this guild"""
-        return await self.gate.exec_req(api.Blacklist.list(guild_id=self.id))
+        return await self._singleflight(('blacklist',),
+                                        lambda: self.gate.exec_req(api.Blacklist.list(guild_id=self.id)))
 
     async def ban(self, user: Union[User, str], remark: str = None, del_msg_days: int = 0):
         """ban user on this guild"""
-        target_id = user.id if isinstance(user, User) else user
-        return await self.gate.exec_req(
+        target_id = _unpack_id(user)
+        ret = await self.gate.exec_req(
             api.Blacklist.create(guild_id=self.id, target_id=target_id, remark=remark, del_msg_days=del_msg_days))
+        self.gate.invalidate_user(self.id, target_id)
+        return ret
 
     async def unban(self, user: Union[User, str]):
         """unban user on this guild"""
-        target_id = user.id if isinstance(user, User) else user
+        target_id = _unpack_id(user)
         return await self.gate.exec_req(api.Blacklist.delete(guild_id=self.id, target_id=target_id))
 
     async def get_badge(self, style: int = 0):
         """get badge from this guild"""
-        return await self.gate.exec_req(api.Badge.guild(guild_id=self.id, style=style))
+        return await self._singleflight(('badge', style),
+                                        lambda: self.gate.exec_req(api.Badge.guild(guild_id=self.id, style=style)))
 
     async def fetch_emojis(self, page: int = None, page_size: int = None):
-        return await self.gate.exec_req(api.GuildEmoji.list(guild_id=self.id, page=page, page_size=page_size))
+        return await self._singleflight(
+            ('emojis', page, page_size),
+            lambda: self.gate.exec_req(api.GuildEmoji.list(guild_id=self.id, page=page, page_size=page_size)))
 
     async def create_emoji(self, name: str, emoji: str):
-        return await self.gate.exec_req(api.GuildEmoji.create(guild_id=self.id, name=name, emoji=open(emoji, 'rb')))
+        """create emoji from the image file at path ``emoji``"""
+        async with aiofiles.open(emoji, 'rb') as f:
+            data = io.BytesIO(await f.read())
+        data.name = os.path.basename(emoji)  # used as the filename in multipart form
+        return await self.gate.exec_req(api.GuildEmoji.create(guild_id=self.id, name=name, emoji=data))
 
     async def update_emoji(self, name: str, id: str):
         return await self.gate.exec_req(api.GuildEmoji.update(name=name, id=id))
@@ -199,7 +360,9 @@ class Guild(LazyLoadable, Requestable):
         return await self.gate.exec_req(api.GuildEmoji.delete(id=id))
 
     async def list_invite(self, page: int = None, page_size: int = None):
-        return await self.gate.exec_req(api.Invite.list(guild_id=self.id, page=page, page_size=page_size))
+        return await self._singleflight(
+            ('invites', page, page_size),
+            lambda: self.gate.exec_req(api.Invite.list(guild_id=self.id, page=page, page_size=page_size)))
 
     async def creat_invite(self,
                            duration: InviteDurationTypes = InviteDurationTypes.SEVEN_DAYS,
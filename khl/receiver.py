@@ -1,11 +1,14 @@
 import asyncio
 import logging
-import time
+import random
 import zlib
 from abc import ABC, abstractmethod
-from typing import Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
 
-from aiohttp import ClientWebSocketResponse, ClientSession, web, WSMessage
+import orjson
+from cachetools import TTLCache
+from aiohttp import ClientWebSocketResponse, ClientSession, TCPConnector, web, WSMessage
 
 from .cert import Cert
 from .interface import AsyncRunnable
@@ -38,128 +41,227 @@ class Receiver(AsyncRunnable, ABC):
     async def start(self):
         raise NotImplementedError
 
+    async def close(self):
+        """release resources held by the receiver, ``Gateway.run()`` calls it every time ``start()`` returns"""
+        pass
+
 
 class WebsocketReceiver(Receiver):
+    OFFLOAD_SIZE = 4096
+    """compressed frames larger than this(in bytes) are decoded in a worker thread"""
+    HEARTBEAT_INTERVAL = 26
+    """seconds between heartbeats"""
+    HEARTBEAT_JITTER = 2
+    """heartbeats are shifted randomly within this many seconds, so multiple bots do not beat in lockstep"""
 
     def __init__(self, cert: Cert, compress: bool):
         self._cert = cert
         self.compress = compress
+        self._decode_pool: Optional[ThreadPoolExecutor] = None
 
         self._NEWEST_SN = 0
         self._RAW_GATEWAY = ''
+        self._hb_handle: Optional[asyncio.TimerHandle] = None
+        self._hb_task: Optional[asyncio.Task] = None
+        self._cs: Optional[ClientSession] = None
 
     @property
     def type(self) -> str:
         return 'websocket'
 
-    async def heartbeat(self, ws_conn: ClientWebSocketResponse):
-        while True:
-            try:
-                await asyncio.sleep(26)
-                await ws_conn.send_json({'s': 2, 'sn': self._NEWEST_SN})
-            except Exception as e:
-                log.exception('error raised during websocket heartbeat', exc_info=e)
+    def _schedule_heartbeat(self, ws_conn: ClientWebSocketResponse):
+        delay = self.HEARTBEAT_INTERVAL + random.uniform(-self.HEARTBEAT_JITTER, self.HEARTBEAT_JITTER)
+        self._hb_handle = asyncio.get_event_loop().call_later(delay, self._fire_heartbeat, ws_conn)
+
+    def _fire_heartbeat(self, ws_conn: ClientWebSocketResponse):
+        # keep a reference, or the pending task may be garbage collected
+        self._hb_task = asyncio.ensure_future(self._send_heartbeat(ws_conn))
+
+    async def _send_heartbeat(self, ws_conn: ClientWebSocketResponse):
+        try:
+            await ws_conn.send_str(orjson.dumps({'s': 2, 'sn': self._NEWEST_SN}).decode())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.exception('error raised during websocket heartbeat', exc_info=e)
+        if not ws_conn.closed:
+            self._schedule_heartbeat(ws_conn)
+
+    def _cancel_heartbeat_handle(self):
+        if self._hb_handle is not None:
+            self._hb_handle.cancel()
+            self._hb_handle = None
+
+    async def _stop_heartbeat(self):
+        # cancel the timer first so it can not spawn a new task while the running one is awaited
+        self._cancel_heartbeat_handle()
+        task, self._hb_task = self._hb_task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        # the task may have scheduled a new timer before it was cancelled
+        self._cancel_heartbeat_handle()
+
+    def _decode_blob(self, data: bytes) -> Dict:
+        """decompress and decode a frame, runs in ``_decode_pool``"""
+        return self._cert.decode_raw(zlib.decompress(data))
 
     async def start(self):
-        async with ClientSession(loop=self.loop) as cs:
-            headers = {
-                'Authorization': f'Bot {self._cert.token}',
-                'Content-type': 'application/json'
-            }
-            params = {'compress': 1 if self.compress else 0}
-            async with cs.get(f"{API}/gateway/index",
-                              headers=headers,
-                              params=params) as res:
-                res_json = await res.json()
-                if res_json['code'] != 0:
-                    log.error(f'getting gateway: {res_json}')
-                    return
-
-                self._RAW_GATEWAY = res_json['data']['url']
-
-            async with cs.ws_connect(self._RAW_GATEWAY) as ws_conn:
-                asyncio.ensure_future(self.heartbeat(ws_conn), loop=self.loop)
-
-                log.info('[ init ] launched')
+        if self._cs is None or self._cs.closed:
+            # lives until `close()`, which `Gateway.run()` calls once this `start()` returns
+            self._cs = ClientSession(connector=TCPConnector(limit_per_host=64, ttl_dns_cache=300))
+        if self._decode_pool is None:
+            self._decode_pool = ThreadPoolExecutor(max_workers=2)
+        cs = self._cs
+        headers = {
+            'Authorization': f'Bot {self._cert.token}',
+            'Content-type': 'application/json'
+        }
+        params = {'compress': 1 if self.compress else 0}
+        async with cs.get(f"{API}/gateway/index",
+                          headers=headers,
+                          params=params) as res:
+            res_json = await res.json()
+            if res_json['code'] != 0:
+                log.error(f'getting gateway: {res_json}')
+                return
+
+            self._RAW_GATEWAY = res_json['data']['url']
+
+        async with cs.ws_connect(self._RAW_GATEWAY) as ws_conn:
+            self._schedule_heartbeat(ws_conn)
+
+            log.info('[ init ] launched')
 
+            try:
+                # hoisted into locals, this loop runs once per frame
+                run_in_executor = asyncio.get_event_loop().run_in_executor
+                decode_pool = self._decode_pool
+                decode_blob = self._decode_blob
+                decode_raw = self._cert.decode_raw
+                # every frame is an independent zlib stream, so a shared decompressobj can not be used here
+                decompress = zlib.decompress if self.compress else None
+                offload_size = self.OFFLOAD_SIZE
+                queue_put = self.pkg_queue.put
+                # checked per frame so runtime level changes apply, the result is cached by logging
+                is_enabled_for = log.isEnabledFor
+                debug = logging.DEBUG
                 async for raw in ws_conn:
                     raw: WSMessage
                     try:
                         data = raw.data
-                        data = zlib.decompress(data) if self.compress else data
-                        pkg: Dict = self._cert.decode_raw(data)
-                        log.debug(f'upcoming raw: {pkg}')
+                        if decompress is None:
+                            pkg: Dict = decode_raw(data)
+                        elif len(data) > offload_size:
+                            # zlib releases the GIL, keep the event loop free while decoding large frames
+                            pkg: Dict = await run_in_executor(decode_pool, decode_blob, data)
+                        else:
+                            pkg: Dict = decode_raw(decompress(data))
+                        if is_enabled_for(debug):
+                            log.debug(f'upcoming raw: {pkg}')
                         if pkg['s'] != 0:
                             continue
-                        self._NEWEST_SN = pkg['sn']
-                        await self.pkg_queue.put(pkg['d'])
+                        self._NEWEST_SN = pkg['sn']  # read by heartbeats, so not deferred to a local
+                        await queue_put(pkg['d'])
                     except Exception as e:
                         log.exception(e)
                         continue
+            finally:
+                await self._stop_heartbeat()
+
+    async def close(self):
+        """
+        close the underlying http session and the decode thread pool, ends this run of the receiver
+
+        a later ``start()`` creates them again
+        """
+        if self._cs is not None:
+            await self._cs.close()
+            self._cs = None
+        if self._decode_pool is not None:
+            self._decode_pool.shutdown(wait=False)
+            self._decode_pool = None
 
 
 class WebhookReceiver(Receiver):
-    def __init__(self, cert: Cert, *, port: int, route: str, compress: bool):
+    def __init__(self, cert: Cert, *, port: int, route: str, compress: bool, reuse_port: bool = False):
+        """
+        :param reuse_port: let multiple processes bind ``port``, CAUTION: webhook packages will be split among them,
+            and the dedup of packages only works within one process
+        """
         self._cert = cert
         self.port = port
+        self.reuse_port = reuse_port
         self.route = route
         self.app = web.Application()
         self.compress = compress
-        self.sn_dup_map = {}
+        self.sn_dup_map = TTLCache(maxsize=200_000, ttl=600)  # sn expires after 600 sec
+        self._stop_event: Optional[asyncio.Event] = None
+        self._stop_requested = False
+        # registered once here, the router is frozen after the first start() so it can not be added again
+        self.app.router.add_post(self.route, self._on_recv)
 
     @property
     def type(self) -> str:
         return 'webhook'
 
     def _is_dup(self, req: dict) -> bool:
-        # TODO: need a recycle count down ring
         sn = req.get('sn', None)
         if sn is None:
             return False
-        current = time.time()
-        if sn in self.sn_dup_map.keys():
-            if current - self.sn_dup_map[sn] <= 600:
-                # 600 sec timed out
-                return True
-        self.sn_dup_map[sn] = current
+        if sn in self.sn_dup_map:
+            return True
+        self.sn_dup_map[sn] = True
         return False
 
-    async def start(self):
-        async def on_recv(request: web.Request):
-            try:
-                data = await request.read()
-                data = zlib.decompress(data) if self.compress else data
-                pkg: Dict = self._cert.decode_raw(data)
-            except Exception as e:
-                log.exception(e)
-                return web.Response()
+    async def _on_recv(self, request: web.Request):
+        try:
+            data = await request.read()
+            data = zlib.decompress(data) if self.compress else data
+            pkg: Dict = self._cert.decode_raw(data)
+        except Exception as e:
+            log.exception(e)
+            return web.Response()
 
-            if not pkg:  # empty pkg
-                return web.Response()
+        if not pkg:  # empty pkg
+            return web.Response()
 
-            if pkg['d']['verify_token'] != self._cert.verify_token:  # check verify_token
-                return web.Response()
+        if pkg['d']['verify_token'] != self._cert.verify_token:  # check verify_token
+            return web.Response()
 
-            if self._is_dup(pkg):  # dup pkg
-                return web.Response()
+        if self._is_dup(pkg):  # dup pkg
+            return web.Response()
 
-            if pkg['s'] == 0:
-                pkg = pkg['d']
-                if pkg['type'] == 255 and pkg['channel_type'] == 'WEBHOOK_CHALLENGE':
-                    return web.json_response({'challenge': pkg['challenge']})
-                await self.pkg_queue.put(pkg)
+        if pkg['s'] == 0:
+            pkg = pkg['d']
+            if pkg['type'] == 255 and pkg['channel_type'] == 'WEBHOOK_CHALLENGE':
+                return web.json_response({'challenge': pkg['challenge']})
+            await self.pkg_queue.put(pkg)
 
-            return web.Response()
+        return web.Response()
 
-        self.app.router.add_post(self.route, on_recv)
+    async def start(self):
+        # created before any await, so a stop() during setup is not lost
+        self._stop_event = asyncio.Event()
+        if self._stop_requested:  # stop() was called before start()
+            self._stop_requested = False
+            self._stop_event.set()
 
         runner = web.AppRunner(self.app)
         await runner.setup()  # runner use its own loop, can not be set
-        site = web.TCPSite(runner, '0.0.0.0', self.port)
-
-        log.info('[ init ] launched')
-
-        await site.start()
-
-        while True:
-            await asyncio.sleep(3600)  # sleep forever
+        site = web.TCPSite(runner, '0.0.0.0', self.port, backlog=512, reuse_port=self.reuse_port)
+
+        try:
+            await site.start()
+            log.info('[ init ] launched')
+            await self._stop_event.wait()
+        finally:
+            self._stop_event = None
+            await runner.cleanup()  # also runs app.on_shutdown hooks
+
+    def stop(self):
+        """stop the webhook server, ``start()`` returns after it shuts down and can be called again later"""
+        if self._stop_event is not None:
+            self._stop_event.set()
+        else:
+            self._stop_requested = True
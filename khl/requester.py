@@ -1,6 +1,8 @@
 import asyncio
+import io
 import logging
-from typing import Union, List
+import time
+from typing import Union, List, Dict, Mapping, AsyncIterator
 
 from aiohttp import ClientSession
 
@@ -12,10 +14,57 @@ log = logging.getLogger(__name__)
 API = f'https://www.kaiheila.cn/api/v3'
 
 
+class RateLimiter:
+    """
+    track rate limit buckets from response headers, hold requests until the bucket resets instead of getting 429
+
+    docs: https://developer.kaiheila.cn/doc/rate-limit
+    """
+
+    def __init__(self):
+        self._route_bucket: Dict[str, str] = {}
+        self._remaining: Dict[str, int] = {}
+        self._reset_at: Dict[str, float] = {}
+        self._global_reset_at = 0.0
+
+    async def acquire(self, route: str):
+        """wait until a request to ``route`` is allowed, then take one from its bucket"""
+        while True:
+            now = time.monotonic()
+            delay = self._global_reset_at - now
+            bucket = self._route_bucket.get(route)
+            if bucket in self._reset_at:
+                if self._reset_at[bucket] <= now:  # bucket refilled, forget the outdated record
+                    del self._reset_at[bucket]
+                    del self._remaining[bucket]
+                elif self._remaining[bucket] <= 0:
+                    delay = max(delay, self._reset_at[bucket] - now)
+            if delay <= 0:
+                break
+            log.debug(f'rate limited: {route}, wait {delay:.2f}s')
+            await asyncio.sleep(delay)
+        if bucket in self._remaining:
+            self._remaining[bucket] -= 1
+
+    def update(self, route: str, headers: Mapping[str, str], limited: bool = False):
+        """record bucket status from response headers, ``limited`` means the response is 429"""
+        bucket = headers.get('X-Rate-Limit-Bucket')
+        reset = headers.get('X-Rate-Limit-Reset')
+        if bucket is None or reset is None:
+            return
+        reset_at = time.monotonic() + float(reset)
+        self._route_bucket[route] = bucket
+        self._remaining[bucket] = 0 if limited else int(headers.get('X-Rate-Limit-Remaining', 1))
+        self._reset_at[bucket] = reset_at
+        if 'X-Rate-Limit-Global' in headers:
+            self._global_reset_at = reset_at
+
+
 class HTTPRequester:
     def __init__(self, cert: Cert):
         self._cert = cert
         self._cs: ClientSession = ClientSession()
+        self._limiter = RateLimiter()
 
     def __del__(self):
         asyncio.get_event_loop().run_until_complete(self._cs.close())
@@ -25,19 +74,36 @@ class HTTPRequester:
         headers['Authorization'] = f'Bot {self._cert.token}'
         params['headers'] = headers
 
-        async with self._cs.request(method, f'{API}/{route}', **params) as res:
-            log.debug(f'req: {method} {route}: {params}')
-            if res.content_type == 'application/json':
-                rsp = await res.json()
-                if rsp['code'] != 0:
-                    raise HTTPRequester.APIRequestFailed(method, route, params, rsp['code'], rsp['message'])
+        # file objects in data are read to the end by a request, rewind them before retrying
+        data = params.get('data')
+        streams = [v for v in data.values() if isinstance(v, io.IOBase)] if isinstance(data, dict) else []
+        can_retry = all(i.seekable() for i in streams)
+        positions = [i.tell() for i in streams] if can_retry else []
+
+        retried = False
+        while True:
+            await self._limiter.acquire(route)
+            async with self._cs.request(method, f'{API}/{route}', **params) as res:
+                log.debug(f'req: {method} {route}: {params}')
+                limited = res.status == 429
+                self._limiter.update(route, res.headers, limited)
+                if limited and not retried and can_retry:
+                    log.warning(f'req rate limited, retry later: {method} {route}')
+                    for stream, pos in zip(streams, positions):
+                        stream.seek(pos)
+                    retried = True
+                    continue
+                if res.content_type == 'application/json':
+                    rsp = await res.json()
+                    if rsp['code'] != 0:
+                        raise HTTPRequester.APIRequestFailed(method, route, params, rsp['code'], rsp['message'])
+                    else:
+                        log.debug(f'req done: {rsp}')
+                    return rsp['data']
                 else:
+                    rsp = await res.read()
                     log.debug(f'req done: {rsp}')
-                return rsp['data']
-            else:
-                rsp = await res.read()
-                log.debug(f'req done: {rsp}')
-                return rsp
+                    return rsp
 
     async def exec_req(self, r: _Req):
         return await self.request(r.method, r.route, **r.params)
@@ -52,11 +118,58 @@ class HTTPRequester:
         """
         exec pagination requests, iter from ``begin_page`` to the ``end_page``, ``end_page=None`` means to the end
 
+        collects all items from ``iter_pagination_req()`` into a list
+        """
+        return [i async for i in self.iter_pagination_req(r, begin_page=begin_page, end_page=end_page,
+                                                          page_size=page_size, sort=sort)]
+
+    async def exec_pagination_req_parallel(self,
+                                           r: _Req,
+                                           *,
+                                           page_size: int = 50,
+                                           sort: str = '',
+                                           concurrency: int = 64) -> List:
+        """
+        exec pagination requests concurrently, return all items in page order
+
+        1. req the first page to learn ``page_total``
+        2. req the rest pages, at most ``concurrency`` of them in flight at the same time
+        """
+
+        def page_req(page: int) -> _Req:
+            query = dict(r.params['params'], page=page, page_size=page_size)
+            if sort:
+                query['sort'] = sort
+            return _Req(r.method, r.route, dict(r.params, params=query))
+
+        first = await self.exec_req(page_req(1))
+        page_size = first['meta']['page_size']
+        sem = asyncio.Semaphore(concurrency)
+
+        async def fetch(page: int) -> List:
+            async with sem:
+                return (await self.exec_req(page_req(page)))['items']
+
+        rest = await asyncio.gather(*[fetch(p) for p in range(2, first['meta']['page_total'] + 1)])
+        ret = list(first['items'])
+        for items in rest:
+            ret.extend(items)
+        return ret
+
+    async def iter_pagination_req(self,
+                                  r: _Req,
+                                  *,
+                                  begin_page: int = 1,
+                                  end_page: int = None,
+                                  page_size: int = 50,
+                                  sort: str = '') -> AsyncIterator:
+        """
+        exec pagination requests and yield items as each page arrives, params are same as ``exec_pagination_req()``
+
         1. get a req, inject the params
         2. req and receive the result
-        3. unwrap the result, append result, fresh pagination params
+        3. unwrap the result, yield items, fresh pagination params
         """
-        ret = []
         current_page = begin_page
         while end_page is None or current_page < end_page:
             r.params['params']['page'] = current_page
@@ -66,16 +179,15 @@ class HTTPRequester:
 
             p = await self.exec_req(r)
 
-            ret.extend(p['items'])
+            for i in p['items']:
+                yield i
             current_page = p['meta']['page']
             page_total = p['meta']['page_total']
             page_size = p['meta']['page_size']
 
             current_page += 1
             if end_page is None:
-                end_page = page_total
-
-        return ret
+                end_page = page_total + 1  # ``end_page`` is exclusive
 
     class APIRequestFailed(Exception):
         def __init__(self, method, route, params, err_code, err_message):
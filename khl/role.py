@@ -1,9 +1,15 @@
+# (field, default) pairs filled from payload in `Role.__init__()`, besides `id` which comes from `role_id`
+_FIELDS = (('name', ''), ('color', 0), ('position', 0), ('hoist', 0), ('mentionable', 0), ('permissions', 0))
+
+
 class Role:
     """
     `Standard Object`
 
     represent the component that used in permission control and user identify
     """
+    __slots__ = ('id', 'name', 'color', 'position', 'hoist', 'mentionable', 'permissions')
+
     id: int
     name: str
     color: int
@@ -14,9 +20,5 @@ class Role:
 
     def __init__(self, **kwargs):
         self.id: int = kwargs.get("role_id", 0)
-        self.name: str = kwargs.get("name", "")
-        self.color: int = kwargs.get("color", 0)
-        self.position: int = kwargs.get("position", 0)
-        self.hoist: int = kwargs.get("hoist", 0)
-        self.mentionable: int = kwargs.get("mentionable", 0)
-        self.permissions: int = kwargs.get("permissions", 0)
+        for k, default in _FIELDS:
+            setattr(self, k, kwargs.get(k, default))
@@ -6,6 +6,10 @@ from .gateway import Requestable
 from .interface import LazyLoadable
 from .role import Role
 
+# (field, default) pairs filled from payload in `User.__init__()`
+_FIELDS = (('id', ''), ('username', ''), ('nickname', ''), ('identify_num', ''), ('online', False), ('bot', False),
+           ('status', 0), ('avatar', ''), ('vip_avatar', ''), ('mobile_verified', False))
+
 
 class User(LazyLoadable, Requestable):
     """
@@ -13,6 +17,9 @@ class User(LazyLoadable, Requestable):
 
     represent a entity that interact with khl server
     """
+    __slots__ = ('id', 'username', 'nickname', 'identify_num', 'online', 'bot', 'status', 'avatar', 'vip_avatar',
+                 'mobile_verified', 'roles', '_loaded', '_channel', 'gate')
+
     id: str
     username: str
     nickname: str
@@ -29,16 +36,8 @@ class User(LazyLoadable, Requestable):
     _channel: PrivateChannel
 
     def __init__(self, **kwargs):
-        self.id = kwargs.get('id', '')
-        self.username = kwargs.get('username', '')
-        self.nickname = kwargs.get('nickname', '')
-        self.identify_num = kwargs.get('identify_num', '')
-        self.online = kwargs.get('online', False)
-        self.bot = kwargs.get('bot', False)
-        self.status = kwargs.get('status', 0)
-        self.avatar = kwargs.get('avatar', '')
-        self.vip_avatar = kwargs.get('vip_avatar', '')
-        self.mobile_verified = kwargs.get('mobile_verified', False)
+        for k, default in _FIELDS:
+            setattr(self, k, kwargs.get(k, default))
         self.roles = kwargs.get('roles', [])
 
         self._loaded = kwargs.get('_lazy_loaded_', False)